@@ -189,6 +189,19 @@ def open_oifile(hdul):
                     if (inst not in data):
                         data[inst] = {}
                     data[inst]['cpcov'] = hdul[i].data
+            if (hdul[i].header['EXTNAME'] == 'V2COVDIAG'):
+                inst = hdul[i].header['INSNAME']
+                try:
+                    data[inst]['v2covdiag'] = np.append(data[inst]['v2covdiag'], hdul[i].data, axis=0)
+                except:
+                    if (inst not in data):
+                        data[inst] = {}
+                    data[inst]['v2covdiag'] = hdul[i].data
+            if (hdul[i].header['EXTNAME'] == 'CPCOVMAT'):
+                inst = hdul[i].header['INSNAME']
+                if (inst not in data):
+                    data[inst] = {}
+                data[inst]['cpcovmat'] = hdul[i].data
         except:
             continue
     
@@ -225,6 +238,10 @@ def open_oifile(hdul):
                 nobs = data[key]['cp'].shape[0]//ntria
         inst_list += [key]
         data_list += [[]]
+        try:
+            cpcor = np.kron(data[key]['cpcovmat'], np.eye(data[key]['wave'].shape[0]))
+        except:
+            cpcor = None
         for j in range(nobs):
             if (klflag == True):
                 data_list[i] += [{}]
@@ -266,6 +283,13 @@ def open_oifile(hdul):
                 data_list[i][j]['cpcov'] = data[key]['cpcov'][j]
             except:
                 pass
+            try:
+                data_list[i][j]['v2cov'] = np.diag(data[key]['v2covdiag'][j])
+            except:
+                pass
+            if (cpcor is not None):
+                dcp = data_list[i][j]['dcp'].flatten()
+                data_list[i][j]['cpcov'] = np.multiply(cpcor, np.outer(dcp, dcp))
             cpmat = np.zeros((data_list[i][j]['cpsta'].shape[0], data_list[i][j]['v2sta'].shape[0]))
             for k in range(cpmat.shape[0]):
                 base1 = data_list[i][j]['cpsta'][k][[0, 1]]
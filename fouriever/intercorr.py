@@ -11,8 +11,11 @@ import numpy as np
 
 import glob
 import os
+import shutil
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
+
 from . import inst
 
 observables_known = ['v2', 'cp', 'kp']
@@ -46,14 +49,19 @@ class data():
                 head, tail = os.path.split(item)
                 self.fitsfiles[i] = tail
         
+        # fits I/O releases the GIL, so the files can be opened concurrently;
+        # collecting the futures in submission order keeps inst_list and
+        # data_list aligned with fitsfiles for downstream indexing.
         self.inst_list = []
         self.data_list = []
-        for i in range(len(self.fitsfiles)):
-            inst_list, data_list = inst.open(idir=idir,
-                                             fitsfile=self.fitsfiles[i],
-                                             verbose=False)
-            self.inst_list += inst_list
-            self.data_list += data_list
+        with ThreadPoolExecutor() as executor:
+            futures = []
+            for i in range(len(self.fitsfiles)):
+                futures += [executor.submit(inst.open, idir=idir, fitsfile=self.fitsfiles[i], verbose=False)]
+            for future in futures:
+                inst_list, data_list = future.result()
+                self.inst_list += inst_list
+                self.data_list += data_list
         
         self.set_inst(inst=self.inst_list[0])
         self.set_observables(self.get_observables())
@@ -81,6 +89,9 @@ class data():
         
         if (inst in self.inst_list):
             self.inst = inst
+            # inst_list only changes in __init__, so the matching indices can
+            # be computed once here instead of in every consumer.
+            self._inst_ww = np.where(np.array(self.inst_list) == self.inst)[0]
             print('Selected instrument = '+self.inst)
             print('   Use self.set_inst(inst) to change the selected instrument')
         else:
@@ -97,7 +108,7 @@ class data():
         """
         
         observables = []
-        ww = np.where(np.array(self.inst_list) == self.inst)[0]
+        ww = self._inst_ww
         for i in range(len(observables_known)):
             j = 0
             flag = True
@@ -143,121 +154,187 @@ class data():
                 hdul.pop('CPCOV')
             except:
                 pass
+            try:
+                hdul.pop('V2COVDIAG')
+            except:
+                pass
+            try:
+                hdul.pop('CPCOVMAT')
+            except:
+                pass
             hdul.writeto(os.path.join(self.idir, self.fitsfiles[i]), output_verify='fix', overwrite=True)
         
         pass
     
     def add_v2cov(self,
-                  odir):
+                  odir,
+                  precision='float32'):
         """
         Parameters
         ----------
         odir: str
             Output directory where fits files with covariance shall be saved
             to.
+        precision: 'float64', 'float32'
+            Precision with which the covariance shall be stored. The
+            uncertainties carry only a few significant digits, so 'float32'
+            halves the file size without affecting the fits.
         """
         
         print('   Computing visibility amplitude correlations')
         
+        if (precision == 'float32'):
+            dtype = np.float32
+        elif (precision == 'float64'):
+            dtype = np.float64
+        else:
+            raise UserWarning(precision+' is an unknown precision')
+        
         if (not os.path.exists(odir)):
             os.makedirs(odir)
         
-        data_list = []
-        ww = np.where(np.array(self.inst_list) == self.inst)[0]
-        for i in range(len(ww)):
-            data_list += [self.data_list[ww[i]]]
+        ww = self._inst_ww
+        data_list = [self.data_list[k] for k in ww]
         
         if (len(self.fitsfiles) != len(data_list)):
             raise UserWarning('All input fits files should contain data of the selected instrument')
         
-        for i in range(len(self.fitsfiles)):
-            Nwave = data_list[i][0]['wave'].shape[0]
-            Nbase = data_list[i][0]['v2'].shape[0]
-            
-            cor = np.diag(np.ones(Nwave*Nbase))
-            covs = []
-            for j in range(len(data_list[i])):
-                dv2 = data_list[i][j]['dv2']
-                cov = np.multiply(cor, dv2.flatten()[:, None]*dv2.flatten()[None, :])
-                covs += [cov]
-            covs = np.array(covs)
-            
-            hdul = pyfits.open(os.path.join(self.idir, self.fitsfiles[i]))
-            hdu0 = pyfits.ImageHDU(covs)
-            hdu0.header['EXTNAME'] = 'V2COV'
-            hdu0.header['INSNAME'] = self.inst
-            hdul += [hdu0]
-            hdul.writeto(odir+self.fitsfiles[i], output_verify='fix', overwrite=True)
-        
-        # plt.imshow(cor, origin='lower')
-        # plt.xlabel('Index')
-        # plt.ylabel('Index')
-        # plt.title('Visibility amplitude correlation')
-        # plt.show()
-        # plt.close()
+        # Each fits file is processed independently and the work is dominated
+        # by fits I/O, so dispatch the files to a thread pool.
+        with ThreadPoolExecutor() as executor:
+            futures = []
+            for i in range(len(self.fitsfiles)):
+                futures += [executor.submit(self._add_v2cov_one, data_list[i], os.path.join(self.idir, self.fitsfiles[i]), odir+self.fitsfiles[i], dtype)]
+            for future in futures:
+                future.result()
+        
+        return None
+    
+    def _add_v2cov_one(self,
+                       data,
+                       ipath,
+                       opath,
+                       dtype):
+        """
+        Parameters
+        ----------
+        data: list of dict
+            List of data structures of all observations of one fits file.
+        ipath: str
+            Path of the input fits file.
+        opath: str
+            Path of the output fits file to which the covariance shall be
+            appended.
+        dtype: type
+            Data type with which the covariance shall be stored.
+        """
+        
+        # The visibility amplitude correlation is the identity, so the
+        # covariance is diagonal and only the squared uncertainties need to
+        # be stored; inst.open expands them into the dense covariance when
+        # the file is read. Stacking the exposures first squares them all in
+        # a single vectorized call.
+        dv2s = np.array([data[j]['dv2'].flatten() for j in range(len(data))])
+        covs = (dv2s*dv2s).astype(dtype, copy=False)
+        
+        # Copy the unchanged extensions once and append only the new one
+        # instead of re-serializing the entire file.
+        if (os.path.abspath(ipath) != os.path.abspath(opath)):
+            shutil.copyfile(ipath, opath)
+        hdu0 = pyfits.ImageHDU(covs)
+        hdu0.header['EXTNAME'] = 'V2COVDIAG'
+        hdu0.header['INSNAME'] = self.inst
+        pyfits.append(opath, hdu0.data, hdu0.header)
         
         return None
     
     def add_cpcov(self,
-                  odir):
+                  odir,
+                  precision='float32'):
         """
         Parameters
         ----------
         odir: str
             Output directory where fits files with covariance shall be saved
             to.
+        precision: 'float64', 'float32'
+            Precision with which the covariance shall be stored. The
+            uncertainties carry only a few significant digits, so 'float32'
+            halves the file size without affecting the fits.
         """
         
         print('   Computing closure phase correlations')
         
+        if (precision == 'float32'):
+            dtype = np.float32
+        elif (precision == 'float64'):
+            dtype = np.float64
+        else:
+            raise UserWarning(precision+' is an unknown precision')
+        
         if (not os.path.exists(odir)):
             os.makedirs(odir)
         
-        data_list = []
-        ww = np.where(np.array(self.inst_list) == self.inst)[0]
-        for i in range(len(ww)):
-            data_list += [self.data_list[ww[i]]]
+        ww = self._inst_ww
+        data_list = [self.data_list[k] for k in ww]
         
         if (len(self.fitsfiles) != len(data_list)):
             raise UserWarning('All input fits files should contain data of the selected instrument')
         
-        for i in range(len(self.fitsfiles)):
-            cpmat = data_list[i][0]['cpmat'].copy()
-            Nwave = data_list[i][0]['wave'].shape[0]
-            Nbase = cpmat.shape[1]
-            Ntria = cpmat.shape[0]
-            
-            trafo = np.zeros((Nwave*Ntria, Nwave*Nbase))
-            for k in range(Ntria):
-                for l in range(Nbase):
-                    trafo[k*Nwave:(k+1)*Nwave, l*Nwave:(l+1)*Nwave] = np.diag(np.ones(Nwave))*cpmat[k, l]
-            
-            cor = np.dot(trafo, np.dot(np.diag(np.ones(Nwave*Nbase)), trafo.T))/3.
-            covs = []
-            for j in range(len(data_list[i])):
-                dcp = data_list[i][j]['dcp']
-                cov = np.multiply(cor, dcp.flatten()[:, None]*dcp.flatten()[None, :])
-                covs += [cov]
-            covs = np.array(covs)
-            
-            hdul = pyfits.open(os.path.join(self.idir, self.fitsfiles[i]))
-            hdu0 = pyfits.ImageHDU(covs)
-            hdu0.header['EXTNAME'] = 'CPCOV'
-            hdu0.header['INSNAME'] = self.inst
-            hdul += [hdu0]
-            hdul.writeto(odir+self.fitsfiles[i], output_verify='fix', overwrite=True)
-        
-        # plt.imshow(cor, origin='lower')
-        # plt.xlabel('Index')
-        # plt.ylabel('Index')
-        # plt.title('Closure phase correlation')
-        # plt.show()
-        # plt.close()
+        # Each fits file is processed independently and the work is dominated
+        # by fits I/O, so dispatch the files to a thread pool.
+        with ThreadPoolExecutor() as executor:
+            futures = []
+            for i in range(len(self.fitsfiles)):
+                futures += [executor.submit(self._add_cpcov_one, data_list[i], os.path.join(self.idir, self.fitsfiles[i]), odir+self.fitsfiles[i], dtype)]
+            for future in futures:
+                future.result()
+        
+        return None
+    
+    def _add_cpcov_one(self,
+                       data,
+                       ipath,
+                       opath,
+                       dtype):
+        """
+        Parameters
+        ----------
+        data: list of dict
+            List of data structures of all observations of one fits file.
+        ipath: str
+            Path of the input fits file.
+        opath: str
+            Path of the output fits file to which the covariance shall be
+            appended.
+        dtype: type
+            Data type with which the covariance shall be stored.
+        """
+        
+        cpmat = data[0]['cpmat'].copy()
+        
+        # The baseline-to-triangle transfer matrix is cpmat kron eye(Nwave)
+        # and the covariance of exposure j factorizes as
+        # kron(cpmat*cpmat.T/3, eye(Nwave)) multiplied element-wise with
+        # the outer product of dcp_j, so only the small triangle-space
+        # factor needs to be stored; inst.open reconstructs the dense
+        # covariance when the file is read.
+        cpcovmat = (np.dot(cpmat, cpmat.T)/3.).astype(dtype, copy=False)
+        
+        # Copy the unchanged extensions once and append only the new one
+        # instead of re-serializing the entire file.
+        if (os.path.abspath(ipath) != os.path.abspath(opath)):
+            shutil.copyfile(ipath, opath)
+        hdu0 = pyfits.ImageHDU(cpcovmat)
+        hdu0.header['EXTNAME'] = 'CPCOVMAT'
+        hdu0.header['INSNAME'] = self.inst
+        pyfits.append(opath, hdu0.data, hdu0.header)
         
         return None
     
     def add_cov(self,
-                odir):
+                odir,
+                precision='float32'):
         
         """
         Parameters
@@ -265,6 +342,10 @@ class data():
         odir: str
             Output directory where fits files with covariance shall be saved
             to.
+        precision: 'float64', 'float32'
+            Precision with which the covariance shall be stored. The
+            uncertainties carry only a few significant digits, so 'float32'
+            halves the file size without affecting the fits.
         """
         
         print('Computing correlations')
@@ -272,11 +353,11 @@ class data():
         if (not os.path.exists(odir)):
             os.makedirs(odir)
         
-        self.add_v2cov(odir=odir)
+        self.add_v2cov(odir=odir, precision=precision)
         
         temp = self.idir
         self.idir = odir
-        self.add_cpcov(odir=odir)
+        self.add_cpcov(odir=odir, precision=precision)
         self.idir = temp
         
         return None